@@ -10,10 +10,15 @@ Utilities for processing binary streams.
 """
 
 import logging
+import mmap
+import os
 import sys
 
 logger = logging.getLogger(__name__)
 
+# maximum number of buffers in a single writev() call
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
 def read_cstring(f):
     #https://stackoverflow.com/questions/44296354/valueerror-source-code-string-cannot-contain-null-bytes
     r"""
@@ -39,10 +44,25 @@ def read_cstring(f):
     Another bonus for decoding late is to be able to report the cause of the error in filesystem,
     the full path of the problematic name.
 
-    :param f: opened readable binary stream (typically a file)
+    A memory-mapped file is searched for the null byte and sliced
+    at once, instead of being read byte per byte:
+
+    >>> m = mmap.mmap(-1, 16)
+    >>> m.write(b'first\0second\0')
+    13
+    >>> m.seek(0)
+    >>> read_cstring(m), read_cstring(m), m.tell()
+    (b'first', b'second', 13)
+
+    :param f: opened readable binary stream (typically a file), or mmap
     :return: bytes string excluding the final b'\0'
 
     """
+    if isinstance(f, mmap.mmap):
+        start = f.tell()
+        end = f.find(b'\0', start)
+        f.seek(end + 1)
+        return f[start:end]
     buf = b''
     b = f.read(1)
     while b != b'\0':
@@ -72,10 +92,102 @@ def safe_decode(data, prefix=''):
     :param data: bytes
     :param prefix:
     """
+    # no isascii() check first: the UTF-8 decoder has its own ASCII fast path,
+    # and the try block costs nothing until a name fails to decode
     try:
         decoded = data.decode()
     except UnicodeDecodeError as e:
         logger.warning("Error decoding %r: %s", data, e.reason)
         decoded = data.decode(errors='backslashreplace')
         logger.warning("Entry parsed as %r", prefix + decoded)
-    return decoded
\ No newline at end of file
+    return decoded
+
+def safe_decode_all(names, prefix=''):
+    r"""
+    Decodes a list of names with a single `decode()` call,
+    falling back to `safe_decode` for each name on error.
+    Only matched entries should get there: matching works on bytes.
+
+    >>> safe_decode_all([b'a', b'b.txt'])
+    ['a', 'b.txt']
+    >>> safe_decode_all([])
+    []
+    >>> safe_decode_all([b'a', b'messy\xe9e.jpg'], "some/path/")
+    ['a', 'messy\\xe9e.jpg']
+
+    :param names: list of bytes, none of them holding a null byte
+    :param prefix: passed to `safe_decode` for error reports
+    :return: list of strings
+    """
+    if not names:
+        return []
+    try:
+        return b'\0'.join(names).decode().split('\0')
+    except UnicodeDecodeError:
+        return [safe_decode(n, prefix) for n in names]
+
+def write_out(data):
+    r"""
+    Writes to the standard output through its binary buffer:
+    unlike the text layer, it isn't flushed on each line written
+    to a terminal. See `flush_out()`.
+
+    >>> write_out("text\n"); write_out(b"bytes\n")
+    text
+    bytes
+
+    :param data: str, or UTF-8 encoded bytes
+    """
+    out = getattr(sys.stdout, 'buffer', None)
+    if out is None:
+        # text only stream, e.g. captured by doctest
+        sys.stdout.write(data if isinstance(data, str) else data.decode())
+    elif isinstance(data, str):
+        out.write(data.encode(sys.stdout.encoding, sys.stdout.errors))
+    else:
+        out.write(data)
+
+def flush_out():
+    """
+    Flushes the standard output, including data sent by `write_out()`.
+    """
+    sys.stdout.flush()
+    getattr(sys.stdout, 'buffer', sys.stdout).flush()
+
+def write_chunks(chunks):
+    r"""
+    Writes a list of bytes chunks to the standard output,
+    with scatter-gather `os.writev()` calls where available:
+    the chunks are neither written one by one nor joined first.
+
+    >>> write_chunks([b'first ', b'line\n', b'second line\n'])
+    first line
+    second line
+
+    :param chunks: list of UTF-8 encoded bytes
+    """
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        write_out(b''.join(chunks))
+        return
+    # previous output first
+    sys.stdout.flush()
+    for start in range(0, len(chunks), IOV_MAX):
+        batch = chunks[start:start + IOV_MAX]
+        while batch:
+            try:
+                written = os.writev(fd, batch)
+            except BrokenPipeError:
+                # reader gone, e.g. piped to head
+                return
+            # partial write: resume after the last byte written
+            done = 0
+            while done < len(batch) and written >= len(batch[done]):
+                written -= len(batch[done])
+                done += 1
+            batch = batch[done:]
+            if batch and written:
+                batch[0] = batch[0][written:]
@@ -11,15 +11,23 @@ Provides command line arguments parsers and common tools.
 """
 import argparse
 import fnmatch
+import functools
 import logging
 import logging.config
+import operator
+import os
 import re
+import sys
 
 import binutils
 import mlocate
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 
-logging.config.fileConfig('logging.ini')
 LOGGER = logging.getLogger()
 MLOCATE_DEFAULT_DB = "/var/lib/mlocate/mlocate.db"
 
@@ -35,7 +43,7 @@ def base_parser(**kwargs):
     Namespace(..., database='/tmp/MyBook.db', ...)
     >>> parser.print_help() # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     usage: ... [-h] [-L LOG_LEVEL] [-C] [-n] [-r] [-i] [-D] [-d DATABASE]
-              [-I LIMIT_INPUT_DIRS]
+              [-I LIMIT_INPUT_DIRS] [-c]
     <BLANKLINE>
     Test parser
     <BLANKLINE>
@@ -44,8 +52,8 @@ def base_parser(**kwargs):
       -L LOG_LEVEL, --log-level LOG_LEVEL
       -C, --app-config      Show active options
       -n, --dry-run         Dry run, don't parse database
-      -r, --use-regexps     Patterns are given as regular expressions.
-                            Default: False (glob)
+      -r, --use-regexps     Patterns are given as regular expressions, anchored at
+                            start. Default: False (glob)
       -i, --ignore-case     Patterns are matched ignoring character case.
                             Default: False
       -D, --mdb-settings    Print mlocate database settings
@@ -53,6 +61,8 @@ def base_parser(**kwargs):
                             name of the mlocate database
       -I LIMIT_INPUT_DIRS, --limit-input-dirs LIMIT_INPUT_DIRS
                             Maximum directory entries read from db
+      -c, --cache-index     Keep an index of the database directories in
+                            ~/.cache/mlocate-tools, to read it faster next time
 
         """
     parser = argparse.ArgumentParser(**kwargs)
@@ -62,8 +72,8 @@ def base_parser(**kwargs):
     parser.add_argument('-n', '--dry-run', action='store_true',
                         help="Dry run, don't parse database")
     parser.add_argument('-r', '--use-regexps', action='store_true',
-                        help="Patterns are given as regular expressions." +
-                        " Default: False (glob)")
+                        help="Patterns are given as regular expressions," +
+                        " anchored at start. Default: False (glob)")
     parser.add_argument('-i', '--ignore-case', action='store_true',
                         help="Patterns are matched ignoring character case." +
                         " Default: False")
@@ -73,6 +83,9 @@ def base_parser(**kwargs):
                         help="name of the mlocate database")
     parser.add_argument('-I', '--limit-input-dirs', type=int, default=0,
                         help="Maximum directory entries read from db")
+    parser.add_argument('-c', '--cache-index', action='store_true',
+                        help="Keep an index of the database directories in" +
+                        " ~/.cache/mlocate-tools, to read it faster next time")
     return parser
 
 def main_parser():
@@ -88,7 +101,7 @@ def main_parser():
 
     >>> parser.print_help() # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
      usage: ... [-h] [-L LOG_LEVEL] [-C] [-n] [-r] [-i] [-D] [-d DATABASE]
-                        [-I LIMIT_INPUT_DIRS]
+                        [-I LIMIT_INPUT_DIRS] [-c]
                         {find,dups,tree} ...
     <BLANKLINE>
     Explore filesystems through an mlocate database
@@ -98,8 +111,8 @@ def main_parser():
       -L LOG_LEVEL, --log-level LOG_LEVEL
       -C, --app-config      Show active options
       -n, --dry-run         Dry run, don't parse database
-      -r, --use-regexps     Patterns are given as regular expressions. Default:
-                            False (glob)
+      -r, --use-regexps     Patterns are given as regular expressions, anchored at
+                            start. Default: False (glob)
       -i, --ignore-case     Patterns are matched ignoring character case. Default:
                             False
       -D, --mdb-settings    Print mlocate database settings
@@ -107,6 +120,8 @@ def main_parser():
                             name of the mlocate database
       -I LIMIT_INPUT_DIRS, --limit-input-dirs LIMIT_INPUT_DIRS
                             Maximum directory entries read from db
+      -c, --cache-index     Keep an index of the database directories in
+                            ~/.cache/mlocate-tools, to read it faster next time
     <BLANKLINE>
     subcommands:
       valid subcommands
@@ -139,7 +154,7 @@ def add_find_command(cmds):
     >>> cmd = add_find_command(cmds)
     >>> cmd.print_help() # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     usage: ... find [-h] [-M LIMIT_OUTPUT_DIRS] [-m LIMIT_OUTPUT_MATCH]
-                        [-a {test,count,list,json}]
+                        [-a {test,count,list,json}] [-j JOBS] [-p]
                         [patterns [patterns ...]]
     <BLANKLINE>
     positional arguments:
@@ -154,6 +169,9 @@ def add_find_command(cmds):
                             Maximum count of selected entries
       -a {test,count,list,json}, --action {test,count,list,json}
                             what to do with matched directories
+      -j JOBS, --jobs JOBS  Number of worker processes matching directories
+      -p, --prefetch        Read the database ahead in a background thread, with a
+                            single job only
 
     >>> args = main_parser().parse_args('-d /tmp/MyBook.db -I 10 find *.ini'.split())
     >>> run(args)
@@ -207,6 +225,11 @@ def add_find_command(cmds):
     cmd.add_argument('-a', '--action', choices=['test', 'count', 'list', 'json'],
                      default='list',
                      help="what to do with matched directories")
+    cmd.add_argument('-j', '--jobs', type=int, default=1,
+                     help="Number of worker processes matching directories")
+    cmd.add_argument('-p', '--prefetch', action='store_true',
+                     help="Read the database ahead in a background thread, "
+                          "with a single job only")
     cmd.add_argument('patterns', nargs='*',
                      help="Select only directories with entries matching those patterns")
     return cmd
@@ -226,12 +249,12 @@ def add_dups_command(cmds):
       -h, --help  show this help message and exit
 
     >>> parser.parse_args('-r dups /home/mich/\\.virtualenvs/?'.split()) == argparse.Namespace(
-    ... app_config=False, command='dups', database='/var/lib/mlocate/mlocate.db',
+    ... app_config=False, cache_index=False, command='dups', database='/var/lib/mlocate/mlocate.db',
     ... dry_run=False, limit_input_dirs=0, log_level='WARNING', mdb_settings=False,
     ... dir_selectors=['/home/mich/\\.virtualenvs/?'], use_regexps=True, ignore_case=False)
     True
     >>> args = parser.parse_args('-d data/virtualenvs.db dups /home/mich/.virtualenvs/*'.split())
-    >>> args == argparse.Namespace(app_config=False, command='dups', database='data/virtualenvs.db', dry_run=False, limit_input_dirs=0, log_level='WARNING', mdb_settings=False, dir_selectors=['/home/mich/.virtualenvs/*'], use_regexps=False, ignore_case=False)
+    >>> args == argparse.Namespace(app_config=False, cache_index=False, command='dups', database='data/virtualenvs.db', dry_run=False, limit_input_dirs=0, log_level='WARNING', mdb_settings=False, dir_selectors=['/home/mich/.virtualenvs/*'], use_regexps=False, ignore_case=False)
     True
     >>> run(args) # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     Reporting Duplicates
@@ -242,7 +265,7 @@ def add_dups_command(cmds):
        - /home/mich/.virtualenvs/...
        - /home/mich/.virtualenvs/...
     ...
-    >>> parser.parse_args("-d /tmp/MyBook.db -I 100 dups .*[Pp]hotos?/?".split()) == argparse.Namespace(app_config=False, command='dups', database='/tmp/MyBook.db', dry_run=False, limit_input_dirs=100, log_level='WARNING', mdb_settings=False, dir_selectors=['.*[Pp]hotos?/?'], use_regexps=False, ignore_case=False)
+    >>> parser.parse_args("-d /tmp/MyBook.db -I 100 dups .*[Pp]hotos?/?".split()) == argparse.Namespace(app_config=False, cache_index=False, command='dups', database='/tmp/MyBook.db', dry_run=False, limit_input_dirs=100, log_level='WARNING', mdb_settings=False, dir_selectors=['.*[Pp]hotos?/?'], use_regexps=False, ignore_case=False)
     True
 
     """
@@ -272,7 +295,7 @@ def add_tree_command(cmds):
       -l LEVELS, --levels LEVELS
                             Maximum depth of displayed tree fs fs
 
-    >>> args = argparse.Namespace(app_config=False, command='tree', database='/tmp/MyBook.db', dry_run=False,
+    >>> args = argparse.Namespace(app_config=False, cache_index=False, command='tree', database='/tmp/MyBook.db', dry_run=False,
     ...                           patterns=['/run/media/mich/MyBook/Archives'], levels=3, limit_output_dirs=0,
     ...                           limit_input_dirs=0, log_level='WARNING', mdb_settings=False, use_regexps=True, ignore_case=False)
     >>> parser.parse_args('-d /tmp/MyBook.db -r tree /run/media/mich/MyBook/Archives --levels 3'.split()) == args
@@ -292,14 +315,21 @@ def add_tree_command(cmds):
                         help="Select trees whose root is matching one of those patterns fs")
     return cmd
 
+# logging.ini is loaded once, when running, not when importing modules
+_CONFIGURED = False
+
 def log_level(args):
     """
-    adjust the logging level
+    Configures logging on first call, and adjusts the logging level
     >>> main_parser().parse_args('--log-level CRITICAL'.split()) # doctest: +ELLIPSIS
     Namespace(...log_level='CRITICAL'...)
 
     :param args:
     """
+    global _CONFIGURED
+    if not _CONFIGURED:
+        logging.config.fileConfig('logging.ini')
+        _CONFIGURED = True
     LOGGER.setLevel(args.log_level)
 
 
@@ -312,22 +342,25 @@ def print_app_config(args):
     >>> run(args) # doctest: +NORMALIZE_WHITESPACE
     action               : list
     app_config           : True
+    cache_index          : False
     command              : find
     database             : /var/lib/mlocate/mlocate.db
     dry_run              : True
     ignore_case          : False
+    jobs                 : 1
     limit_input_dirs     : 0
     limit_output_dirs    : 0
     limit_output_match   : 0
     log_level            : WARNING
     mdb_settings         : False
     patterns             : []
+    prefetch             : False
     use_regexps          : False
 
     :param args:
     """
-    for k, value in sorted(args.__dict__.items()):
-        print("{0:20} : {1}".format(k, value))
+    sys.stdout.write("".join("{0:20} : {1}\n".format(k, value)
+                             for k, value in sorted(args.__dict__.items())))
 
 def print_mdb_settings(mdb):
     """
@@ -360,22 +393,435 @@ def print_mdb_settings(mdb):
         print("    - {0} = {1}".format(k, value))
     print("     ====================================\n\n")
 
-def regex_compile(patterns, use_regexps=False, ignore_case=False, as_bytes=True):
-    # convert and compile patterns
+@functools.lru_cache(maxsize=256)
+def _translate(pattern):
+    return fnmatch.translate(pattern)
+
+@functools.lru_cache(maxsize=256)
+def _compile(regexp, flags):
+    # unlike re's own cache, not shared with other regexps of the process
+    return re.compile(regexp, flags)
+
+# global inline flags, as found at the start of a regexp
+_GLOBAL_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+
+def _scope_flags(regexp):
+    r"""
+    Turns the global inline flags leading a regexp into a group with
+    the same flags, scoped over the whole regexp: global flags are
+    rejected anywhere but at the start of the expression, so a regexp
+    using them couldn't be wrapped or combined with others.
+
+    >>> _scope_flags('(?i)readme')
+    '(?i:readme)'
+    >>> _scope_flags('(?i)(?s)a.b')
+    '(?is:a.b)'
+    >>> _scope_flags('(?x)a b  # comment')
+    '(?x:a b  # comment\n)'
+    >>> _scope_flags('a(?i)b')
+    'a(?i)b'
+
+    :param regexp: str
+    :return: str
+    """
+    flags = ''
+    pos = 0
+    m = _GLOBAL_FLAGS.match(regexp)
+    while m:
+        flags += m.group(1)
+        pos = m.end()
+        m = _GLOBAL_FLAGS.match(regexp, pos)
+    if not flags:
+        return regexp
+    flags = ''.join(dict.fromkeys(flags))
+    # a verbose comment would run over the closing parenthesis
+    end = '\n)' if 'x' in flags else ')'
+    return '(?' + flags + ':' + regexp[pos:] + end
+
+# a leading match-all, in the DOTALL group of fnmatch translations
+_LEADING_ANY = re.compile(r'(\(\?s:)?\.\*(?![*+?{])')
+# a trailing match-all, not escaped, before the end of fnmatch translations
+_TRAILING_ANY = re.compile(r'(?<!\\)((?:\\\\)*)\.\*(\)\\Z)?$')
+
+def _search_regexp(regexp):
+    r"""
+    Rewrites a regexp meant for `re.match()` into an equivalent one
+    for `re.search()`: search needs no leading `.*`, which makes match
+    backtrack through the whole name. Other regexps get anchored.
+
+    >>> _search_regexp(fnmatch.translate('*.ini'))
+    '(?s:\\.ini)\\Z'
+    >>> _search_regexp(fnmatch.translate('f?.py'))
+    '\\A(?:(?s:f.\\.py)\\Z)'
+    >>> _search_regexp(fnmatch.translate('backup*'))
+    '\\A(?:(?s:backup))'
+
+    Only the `.*` of a DOTALL group, as in `fnmatch` translations,
+    matches any prefix: elsewhere it stops at a newline, and without it
+    a search could start right after one. Other regexps are kept whole:
+
+    >>> _search_regexp('.*ab.*')
+    '\\A(?:.*ab.*)'
+    >>> re.search(_search_regexp(r'.*\.ini'), 'new\nline.ini') is None
+    True
+    >>> _search_regexp('.*a|b')
+    '\\A(?:.*a|b)'
+
+    :param regexp: str
+    :return: str
+    """
+    if '|' in regexp or not regexp.startswith('(?s:'):
+        # stripping could change the scope of alternatives
+        return r'\A(?:' + regexp + ')'
+    m = _TRAILING_ANY.search(regexp)
+    if m:
+        regexp = regexp[:m.start()] + m.group(1) + (')' if m.group(2) else '')
+    m = _LEADING_ANY.match(regexp)
+    if m:
+        return (m.group(1) or '') + regexp[m.end():]
+    return r'\A(?:' + regexp + ')'
+
+def _prepare(patterns, use_regexps, ignore_case, as_bytes, for_search=False):
+    # convert patterns to regexps ready to compile, and compile flags
     if use_regexps:
-        regexps = patterns
+        regexps = [_scope_flags(r) for r in patterns]
     else:
-        regexps = [fnmatch.translate(p) for p in patterns]
+        regexps = [_translate(p) for p in patterns]
+    if for_search:
+        regexps = [_search_regexp(r) for r in regexps]
     if ignore_case:
         flags = re.IGNORECASE
     else:
         flags = 0
     if as_bytes:
-        code = lambda x: x.encode()
-    else:
-        code = lambda x: x
+        # file names are matched as raw bytes: encode like the OS does,
+        # undecodable bytes of command line arguments are restored
+        regexps = [os.fsencode(r) for r in regexps]
+    return regexps, flags
+
+# end of string anchor, not escaped
+_END_ANCHOR = re.compile(rb'(?<!\\)((?:\\\\)*)\\Z')
+
+class HyperscanSelector:
+    r"""
+    Searches bytes strings for several regexps at once, like `re.search()`,
+    with a Hyperscan database: all patterns are compiled into a single
+    automaton, scanned in linear time whatever the patterns.
+
+    >>> if hyperscan:
+    ...     selector = HyperscanSelector([rb'\.ini\Z', rb'\Af.\.py'])
+    ...     [bool(selector.search(n)) for n in (b'a.ini', b'f1.py', b'ff1.py')]
+    ... else:
+    ...     [True, True, False]
+    [True, True, False]
+
+    :param regexps: list of bytes regexps
+    :param ignore_case: match ignoring character case
+    :raise hyperscan.error: when a regexp uses a construct unsupported by Hyperscan
+    """
+
+    def __init__(self, regexps, ignore_case=False):
+        flags = hyperscan.HS_FLAG_SINGLEMATCH
+        if ignore_case:
+            flags |= hyperscan.HS_FLAG_CASELESS
+        # Hyperscan's \Z, like PCRE's, also matches before a final newline
+        regexps = [_END_ANCHOR.sub(rb'\1\\z', r) for r in regexps]
+        self.db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        self.db.compile(expressions=regexps,
+                        ids=list(range(len(regexps))),
+                        elements=len(regexps),
+                        flags=[flags] * len(regexps))
+
+    @staticmethod
+    def _on_match(pattern_id, start, end, flags, hits):
+        hits.append(pattern_id)
+
+    def search(self, name):
+        """
+        :param name: bytes
+        :return: list of matched pattern ids, empty if none matched
+        """
+        hits = []
+        self.db.scan(name, match_event_handler=self._on_match, context=hits)
+        return hits
+
+# characters giving a pattern more meaning than its literal text
+_GLOB_SPECIAL = re.compile(r'[*?[]')
+# glob patterns made of a literal and leading or trailing stars
+_GLOB_AFFIX = re.compile(r'(\*?)([^*?[]*)(\*?)\Z')
+_REGEXP_SPECIAL = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+class LiteralSelector:
+    r"""
+    Selects names equal to some literal names, starting or ending with
+    some literal prefixes or suffixes, or containing some substrings,
+    with plain bytes operations: a set lookup, `startswith()`, `endswith()`
+    and `in` run in C, without any regexp engine dispatch.
+    Other patterns are delegated to a `fallback` selector.
+
+    >>> selector = LiteralSelector(names=[b'README'], prefixes=[b'.git'],
+    ...                            fallback=re.compile(rb'\.ini\Z'))
+    >>> [bool(selector.search(n)) for n in (b'README', b'README.md', b'.gitignore', b'a.ini', b'a.txt')]
+    [True, False, True, True, False]
+    >>> selector = LiteralSelector(names=[b'README', b'Makefile'])
+    >>> [selector.search(n) for n in (b'README', b'README.md', b'Makefile')]
+    [True, False, True]
+    >>> selector = LiteralSelector(suffixes=[b'.ini'], substrings=[b'log'])
+    >>> [selector.search(n) for n in (b'a.ini', b'a.ini.txt', b'catalog.txt')]
+    [True, False, True]
+
+    :param names: names to select exactly
+    :param prefixes: names starting with one of them are selected
+    :param suffixes: names ending with one of them are selected
+    :param substrings: names containing one of them are selected
+    :param fallback: object with a `search()` method, or None
+    """
+
+    def __init__(self, names=(), prefixes=(), suffixes=(), substrings=(), fallback=None):
+        self.names = frozenset(names)
+        self.prefixes = tuple(prefixes)
+        self.suffixes = tuple(suffixes)
+        self.substrings = tuple(substrings)
+        self.fallback = fallback
+        # with a single kind of test, it is bound to a C callable: mapped
+        # over entries it runs without any Python frame, 5x faster
+        if fallback is None and not self.substrings:
+            if not (self.prefixes or self.suffixes):
+                self.search = self.names.__contains__
+            elif not (self.names or self.suffixes):
+                self.search = operator.methodcaller('startswith', self.prefixes)
+            elif not (self.names or self.prefixes):
+                self.search = operator.methodcaller('endswith', self.suffixes)
+
+    def search(self, name):
+        """
+        :param name: bytes
+        :return: True, or the fallback's result, false if nothing matched
+        """
+        if (name in self.names or name.startswith(self.prefixes)
+                or name.endswith(self.suffixes)):
+            return True
+        for s in self.substrings:
+            if s in name:
+                return True
+        return self.fallback is not None and self.fallback.search(name)
+
+class AnySelector:
+    r"""
+    Searches names with several selectors in turn, selecting those
+    found by any of them.
+
+    >>> selector = AnySelector([re.compile(rb'\.ini\Z'), re.compile(rb'(a)\1')])
+    >>> [bool(selector.search(n)) for n in (b'a.ini', b'baa', b'ab')]
+    [True, True, False]
+
+    :param selectors: objects with a `search()` method
+    """
+
+    def __init__(self, selectors):
+        self.selectors = tuple(selectors)
+
+    def search(self, name):
+        """
+        :param name: bytes
+        :return: the first true result of the selectors, None if none
+        """
+        for selector in self.selectors:
+            found = selector.search(name)
+            if found:
+                return found
+        return None
+
+def regex_combine(patterns, use_regexps=False, ignore_case=False, as_bytes=True):
+    r"""
+    Converts and compiles patterns into a single alternation, so that
+    a name is tested against all of them in one regexp call.
+    The result is meant for `search()`, though it selects the same names
+    as `re.match()` with each pattern: see `_search_regexp()`.
+
+    When the `hyperscan` module is available, glob patterns are compiled
+    into a `HyperscanSelector` instead, unless they use constructs it
+    doesn't support (e.g. atomic groups, produced by `fnmatch` for
+    some patterns with several wildcards). Regexps (`use_regexps`) are
+    always compiled by `re`: Hyperscan reads them in the PCRE dialect,
+    where some constructs select other names, like `a{,3}` or `[[:alpha:]]`.
+
+    Otherwise the stdlib `re` engine is used: on short file names,
+    per-call overhead dominates, and both the `regex` module and
+    the PCRE2-JIT bindings measured slower than `re`, 2x and 10x.
+
+    Patterns without any special character, typical of `locate`-like
+    lookups, need no regexp at all: they go to a `LiteralSelector`,
+    and so do the most common globs, a literal with a leading
+    and/or trailing star, like `*.ext`, `prefix*` or `*text*`.
+
+    >>> selector = regex_combine(['*.ini', '*.desktop'])
+    >>> [bool(selector.search(n)) for n in (b'logging.ini', b'app.desktop', b'notes.txt')]
+    [True, True, False]
+    >>> selector = regex_combine(['README', '*.ini'])
+    >>> [bool(selector.search(n)) for n in (b'README', b'README.md', b'logging.ini')]
+    [True, False, True]
+    >>> type(regex_combine(['*.ini', 'log*', '*conf*'])).__name__
+    'LiteralSelector'
+    >>> regex_combine([]) is None
+    True
+
+    File names are matched as raw bytes. Bytes that are not valid in the
+    file system encoding are passed by Python as surrogate escapes in
+    command line arguments, and restored:
+
+    >>> bool(regex_combine(['messy\udce9e?jpg']).search(b'messy\xe9e.jpg'))
+    True
+
+    >>> selector = regex_combine(['a{,3}$', 'x.*'], use_regexps=True)
+    >>> [bool(selector.search(n)) for n in (b'a', b'a{,3}', b'xy')]
+    [True, False, True]
+
+    Regexps with capture groups are searched apart, their backreferences
+    and group names are kept:
+
+    >>> selector = regex_combine(['(x)y', '(a)\\1', '(?P<n>b)', '(?P<n>c)'], use_regexps=True)
+    >>> [bool(selector.search(n)) for n in (b'xy', b'aa', b'ab', b'c')]
+    [True, True, False, True]
+
+    Regexps starting with global inline flags can be combined too:
+
+    >>> selector = regex_combine(['(?i)readme', 'x.*'], use_regexps=True)
+    >>> [bool(selector.search(n)) for n in (b'README', b'xyz', b'a.ini')]
+    [True, True, False]
+
+    Selectors are cached, keyed on the patterns and options, for
+    processes running several searches:
 
-    return [re.compile(code(r), flags) for r in regexps]
+    >>> regex_combine(['*.ini']) is regex_combine(['*.ini'])
+    True
+
+    :param patterns: list of glob patterns, or regexps if `use_regexps`
+    :param use_regexps: patterns are regular expressions
+    :param ignore_case: match ignoring character case
+    :param as_bytes: compile regexps for bytes strings
+    :return: compiled regexp, HyperscanSelector or LiteralSelector,
+             None if no pattern is given
+    """
+    if not patterns:
+        return None
+    return _selector(tuple(patterns), use_regexps, ignore_case, as_bytes)
+
+@functools.lru_cache(maxsize=64)
+def _selector(patterns, use_regexps, ignore_case, as_bytes):
+    if ignore_case:
+        return _combine(patterns, use_regexps, ignore_case, as_bytes)
+    # set aside patterns that are plain text, keyed on their leading and trailing stars
+    literals = {}
+    rest = []
+    for p in patterns:
+        if use_regexps:
+            # a regexp is matched at start of names
+            affix = None if _REGEXP_SPECIAL.search(p) else ('', p, '*')
+        else:
+            m = _GLOB_AFFIX.match(p)
+            affix = m and m.groups()
+        if affix:
+            lead, text, trail = affix
+            literals.setdefault((lead, trail), []).append(os.fsencode(text) if as_bytes else text)
+        else:
+            rest.append(p)
+    selector = None
+    if rest:
+        selector = _combine(rest, use_regexps, ignore_case, as_bytes)
+    if not literals:
+        return selector
+    return LiteralSelector(names=literals.get(('', ''), ()),
+                           prefixes=literals.get(('', '*'), ()),
+                           suffixes=literals.get(('*', ''), ()),
+                           substrings=literals.get(('*', '*'), ()),
+                           fallback=selector)
+
+def _combine(patterns, use_regexps, ignore_case, as_bytes):
+    regexps, flags = _prepare(patterns, use_regexps, ignore_case, as_bytes,
+                              for_search=True)
+    # Hyperscan reads the PCRE dialect: some Python regexps mean
+    # something else there, glob translations don't
+    return _engine(regexps, flags, ignore_case, as_bytes and not use_regexps, patterns,
+                   as_bytes=as_bytes)
+
+def _engine(regexps, flags, ignore_case, use_hyperscan, patterns, as_bytes=True):
+    # compiles prepared regexps with Hyperscan if possible, re otherwise
+    if hyperscan and use_hyperscan:
+        try:
+            return HyperscanSelector(regexps, ignore_case)
+        except hyperscan.error as e:
+            LOGGER.info("Hyperscan can't compile %r (%s), using re", patterns, e)
+    # capture groups would be renumbered or named twice in an alternation,
+    # breaking backreferences: regexps using them are searched apart
+    grouped = [r for r in regexps if _compile(r, flags).groups]
+    regexps = [r for r in regexps if r not in grouped]
+    selectors = [_compile(r, flags) for r in grouped]
+    if regexps:
+        if as_bytes:
+            combined = b"|".join(b"(?:%s)" % r for r in regexps)
+        else:
+            combined = "|".join("(?:%s)" % r for r in regexps)
+        selectors.insert(0, _compile(combined, flags))
+    if len(selectors) == 1:
+        return selectors[0]
+    return AnySelector(selectors)
+
+# start of string anchor, not escaped
+_START_ANCHOR = re.compile(rb'(?<!\\)((?:\\\\)*)\\A')
+
+def regex_prefilter(patterns, use_regexps=False, ignore_case=False):
+    r"""
+    Compiles glob patterns into a single bytes regexp, searched once
+    in all the names of a directory, joined and surrounded by null bytes,
+    or in its raw entries list, where names are preceded by a flag byte,
+    0 or 1 (see `DirBlock.search_names()`): null bytes never appear in
+    file names, they stand for the end of string anchors, and null or
+    flag bytes for the start of string anchors.
+
+    Wildcards may still span several names, so a directory without any
+    match can be skipped, but the others must be matched entry per entry.
+
+    Like `regex_combine()`, the prefilter is a `HyperscanSelector` when
+    possible: a whole directory makes a long enough buffer for Hyperscan
+    to outrun `re` by an order of magnitude.
+
+    >>> prefilter = regex_prefilter(['f?.py', '*.ini'])
+    >>> bool(prefilter.search(b'\x00a.txt\x00f1.py\x00'))
+    True
+    >>> bool(prefilter.search(b'\x00a.txt\x00ff1.py\x00b.ini.txt\x00'))
+    False
+    >>> bool(prefilter.search(b'\x00a.txt\x00\x01f2.py\x00'))
+    True
+    >>> regex_prefilter(['f.\\.py'], use_regexps=True) is None
+    True
+
+    :param patterns: list of glob patterns
+    :param use_regexps: patterns are regular expressions, whose anchors
+                        or lookarounds can't be rewritten safely
+    :param ignore_case: match ignoring character case
+    :return: compiled regexp or HyperscanSelector,
+             None if regexps or no pattern are given
+    """
+    if use_regexps or not patterns:
+        return None
+    return _prefilter(tuple(patterns), ignore_case)
+
+@functools.lru_cache(maxsize=64)
+def _prefilter(patterns, ignore_case):
+    regexps, flags = _prepare(patterns, False, ignore_case, True, for_search=True)
+    # anchors consume the null or flag bytes: no lookaround, unsupported by Hyperscan
+    prefilters = []
+    for r in regexps:
+        r = _END_ANCHOR.sub(rb'\1\\x00', r)
+        if _START_ANCHOR.search(r):
+            # a regexp per flag byte: Hyperscan misses some matches
+            # starting with a [\x00\x01] character class
+            prefilters.append(_START_ANCHOR.sub(rb'\1\\x00', r))
+            prefilters.append(_START_ANCHOR.sub(rb'\1\\x01', r))
+        else:
+            prefilters.append(r)
+    return _engine(prefilters, flags, ignore_case, True, patterns)
 
 def run(args):
     """
@@ -392,6 +838,8 @@ def run(args):
 
     mdb = mlocate.MLocateDB()
     mdb.connect(args.database)
+    if args.cache_index:
+        mdb.load_index()
     if args.mdb_settings:
         print_mdb_settings(mdb)
 
@@ -4,27 +4,128 @@
 # Copyright (c) Michelle Baert
 # Some rights reserved
 # --------------------------------------------------------
+import datetime
+import itertools
 import logging
+import operator
+import re
 from binutils import safe_decode
 
 logger = logging.getLogger(__name__)
 
+# minimum count of entries for a directory to be searched at once,
+# when its raw entries are not at hand: measured with two globs, from
+# 4 entries the join and search cost less than half of matching each
+# name, so they pay off even when half of the directories match
+BATCH_MIN_ENTRIES = 4
+
+# a single entry of a raw entries list: kind byte and name
+_ENTRY = re.compile(rb'([\x00\x01])([^\x00]*)\x00')
+_entry_kind = operator.itemgetter(0)
+_entry_name = operator.itemgetter(1)
+
 class DirBlock:
-    """
+    r"""
     Represents a directory entry as known from an mlocate database.
 
+    Entries are stored as two parallel sequences, `names` and `kinds`,
+    so that matching runs over names only. `contents` rebuilds
+    the (flag, name) pairs.
+
+    >>> d = DirBlock(b'/some/dir', None, [(False, b'file'), (True, b'sub')])
+    >>> d.names, bytes(d.kinds)
+    ([b'file', b'sub'], b'\x00\x01')
+    >>> d.contents
+    [(False, b'file'), (True, b'sub')]
+    >>> DirBlock(b'/some/dir', None, names=[b'sub'], kinds=b'\x01').contents
+    [(True, b'sub')]
+
+    Entries may also be given raw, as read from the database:
+    a flag byte and a null terminated name each. Names and kinds are then
+    only split when first used, directories skipped by a prefilter
+    never are (see `search_names()`).
+
+    >>> d = DirBlock(b'/some/dir', entries=b'\x00file\x00\x01sub\x00')
+    >>> d.names, bytes(d.kinds)
+    ([b'file', b'sub'], b'\x00\x01')
+
+    The time stamp may be given as raw seconds and nanoseconds instead,
+    `dt` is then only built when first used.
+
+    >>> DirBlock(b'/some/dir', sec=1376667438, nsec=885441234).dt.microsecond
+    885441
+
     :param name: bytes
-    :param dt: datetime latest of last modification (mtime) and status time (ctime)
-    :param contents: list of byte strings representing the names of this dir entries
+    :param dt: datetime latest of last modification (mtime) and status time (ctime),
+               or None when given as `sec` and `nsec`
+    :param contents: list of (flag, name) entries of this directory,
+                     a true flag for a subdirectory, names as bytes
+    :param names: list of the entries names, instead of `contents`
+    :param kinds: bytes-like, for each of `names`: 1 for a subdirectory, 0 otherwise
+    :param entries: bytes, raw entries list, instead of `names` and `kinds`
+    :param sec: int seconds part of the time stamp, instead of `dt`
+    :param nsec: int nanoseconds part of the time stamp
     """
 
-    def __init__(self, name, dt, contents):
+    # one instance per directory: no per-instance __dict__
+    __slots__ = ('name', '_dt', 'sec', 'nsec', '_names', '_kinds', 'entries', 'selection')
+
+    def __init__(self, name, dt=None, contents=(), names=None, kinds=None, sec=None, nsec=0,
+                 entries=None):
         # TODO accept bytes or strings transparently. Conversion is client responsability
         self.name = name
-        self.dt = dt
-        self.contents = contents
+        self._dt = dt
+        self.sec = sec
+        self.nsec = nsec
+        if names is None and entries is None:
+            names = [n for _, n in contents]
+            kinds = bytes(bool(f) for f, _ in contents)
+        self._names = names
+        self._kinds = kinds
+        self.entries = entries
         self.selection = None
 
+    def _split_entries(self):
+        # names and kinds out of the raw entries
+        entries = _ENTRY.findall(self.entries)
+        self._names = list(map(_entry_name, entries))
+        self._kinds = b''.join(map(_entry_kind, entries))
+
+    @property
+    def names(self):
+        """
+        :return: list of the entries names
+        """
+        if self._names is None:
+            self._split_entries()
+        return self._names
+
+    @property
+    def kinds(self):
+        """
+        :return: bytes-like, 1 for a subdirectory, 0 otherwise, for each of `names`
+        """
+        if self._kinds is None:
+            self._split_entries()
+        return self._kinds
+
+    @property
+    def dt(self):
+        """
+        :return: datetime, built from `sec` and `nsec` on first access
+        """
+        if self._dt is None and self.sec is not None:
+            # most directories are never printed, don't pay for localtime() upfront
+            self._dt = datetime.datetime.fromtimestamp(self.sec).replace(microsecond=round(self.nsec / 1000))
+        return self._dt
+
+    @property
+    def contents(self):
+        """
+        :return: list of (flag, name) entries
+        """
+        return list(zip(map(bool, self.kinds), self.names))
+
     def _decode(self):
         # FIXME confusing definition and use cases. Now used only in doctest
         r"""
@@ -56,32 +157,95 @@ class DirBlock:
                     contents=[(flag, safe_decode(f, dirname+"/")) for flag,f in self.contents]
         )
 
-    def match_path(self, selectors):
-        for s in selectors:
-            if s.match(self.name):
-                return True
+    def match_path(self, selector):
+        r"""
+        Tests the directory path, with a single call to a selector
+        combining all path patterns.
+
+        >>> import re
+        >>> d = DirBlock(b'/some/dir')
+        >>> d.match_path(re.compile(rb'\A/some/d')), d.match_path(re.compile(rb'\A/other'))
+        (True, False)
+
+        The path is searched as raw bytes, never decoded.
 
-    def match_contents(self, selectors, limit=0):
+        :param selector: bytes regexp or other selector, see `cli.regex_combine()`
+        :return: bool
         """
-        Filters or test directory entries by regexps
+        return bool(selector.search(self.name))
 
-        :param selectors: list of compiled string regexps to apply to dir contents
+    def match_contents(self, selector, limit=0):
+        r"""
+        Filters or test directory entries by regexp
+
+        >>> import re
+        >>> d = DirBlock(b'/some/dir', None, [(False, b'a.ini'), (True, b'sub'), (False, b'b.ini')])
+        >>> d.match_contents(re.compile(rb'.*\.ini'))
+        [(False, b'a.ini'), (False, b'b.ini')]
+        >>> d.match_contents(re.compile(rb'.*\.ini'), limit=1)
+        [(False, b'a.ini')]
+
+        :param selector: compiled regexp searched in dir contents,
+                         typically combining all patterns with `cli.regex_combine()`
         :param limit: maximum count of matched entries to return
         :return:
         """
-        logger.info("match_contents(%s,%r) for %s" % (selectors, limit, self.name))
-        rslts = []
-        for e in self.contents:
-            name = e[1]
-            for s in selectors:
-                if s.match(name):
-                    rslts.append(e)
-                    break
-            if limit and (limit <= len(rslts)):
-                break
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("match_contents(%s,%r) for %s", selector, limit, self.name)
+        names = self.names
+        # only matched entries are paired with their kind
+        rslts = itertools.compress(zip(self.kinds, names), map(selector.search, names))
+        if limit:
+            rslts = itertools.islice(rslts, limit)
+
+        self.selection = [(bool(k), n) for k, n in rslts]
+        return self.selection
+
+    def match_any(self, selector):
+        r"""
+        Tests whether some entry matches the given regexp.
+        Stops at the first match, no list of matched entries is built.
+
+        >>> import re
+        >>> d = DirBlock(b'/some/dir', None, [(False, b'a.txt'), (True, b'sub'), (False, b'b.ini')])
+        >>> d.match_any(re.compile(rb'.*\.ini'))
+        True
+        >>> d.match_any(re.compile(rb'.*\.jpg'))
+        False
+
+        :param selector: compiled regexp searched in dir contents
+        :return: bool
+        """
+        # map() keeps the whole loop in C, any() stops at the first match
+        return any(map(selector.search, self.names))
 
-        self.selection = rslts
-        return rslts
+    def search_names(self, regexp):
+        r"""
+        Searches all entry names at once, joined and surrounded by null bytes,
+        one regexp call for the whole directory.
+        Raw `entries` are searched as they are, each name is preceded
+        by its flag byte, 0 or 1, and followed by a null byte.
+        Otherwise, directories with few entries are not searched and always
+        accepted: joining them costs more than matching entries one by one.
+
+        >>> import re
+        >>> d = DirBlock(b'/some/dir', None, [(False, b'f%d.txt' % i) for i in range(10)])
+        >>> d.search_names(re.compile(rb'\x00f3\.txt\x00'))
+        True
+        >>> d.search_names(re.compile(rb'\.ini\x00'))
+        False
+        >>> d = DirBlock(b'/some/dir', entries=b'\x00a.ini\x00\x01sub\x00')
+        >>> d.search_names(re.compile(rb'[\x00\x01]sub\x00')), d.search_names(re.compile(rb'\.txt\x00'))
+        (True, False)
+
+        :param regexp: compiled bytes regexp or other selector, see `cli.regex_prefilter()`
+        :return: bool, False if no entry can match
+        """
+        if self.entries is not None:
+            return bool(regexp.search(self.entries))
+        if len(self.names) < BATCH_MIN_ENTRIES:
+            return True
+        return bool(regexp.search(b'\0%s\0' % b'\0'.join(self.names)))
 
     def limit_dir_count(self, idx, dlimit=0):
         """
@@ -97,7 +261,7 @@ class DirBlock:
         return 1
 
     def regex_include(self, idx, paths_limit=0, names_limit=0,
-                      path_selectors=None, name_selectors=None):
+                      path_selectors=None, name_selector=None):
         """
         Directory input selector for `MLocateDB.load_some_dirs()` :
         select directories matching given selectors, optionally limiting results counts.
@@ -109,8 +273,8 @@ class DirBlock:
         :param idx: 1-based index of this element
         :param paths_limit: maximum count before stopping iteration
         :param names_limit: maximum count of names to select
-        :param path_selectors : list of compiled regexp patterns for directory path
-        :param name_selectors : list of compiled regexp patterns for contents
+        :param path_selectors : selector combining the patterns for directory path
+        :param name_selector : compiled regexp pattern for contents
         :return: int -1 to stop iteration, 0 to skip dir, 1 to accept it
         """
         if paths_limit and idx > paths_limit:
@@ -119,13 +283,13 @@ class DirBlock:
         if path_selectors:
             if not self.match_path(path_selectors):
                 return 0
-        if name_selectors:
-            if not self.match_contents(name_selectors, names_limit):
+        if name_selector:
+            if not self.match_contents(name_selector, names_limit):
                 return 0
         return 1
 
     def regex_exclude(self, idx, paths_limit=0, names_limit=0,
-                      path_selectors=None, name_selectors=None):
+                      path_selectors=None, name_selector=None):
         """
         Directory input selector for `MLocateDB.load_some_dirs()` :
         select directories *not* matching given selectors, optionally limiting results counts.
@@ -133,8 +297,8 @@ class DirBlock:
         :param idx: 1-based index of this element
         :param paths_limit: maximum count before stopping iteration
         :param names_limit: maximum count of names to select
-        :param path_selectors : list of compiled regexp patterns for directory path
-        :param name_selectors : list of compiled regexp patterns for contents
+        :param path_selectors : selector combining the patterns for directory path
+        :param name_selector : compiled regexp pattern for contents
         :return: int -1 to stop iteration, 0 to skip dir, 1 to accept it
         """
         if paths_limit and idx > paths_limit:
@@ -143,9 +307,9 @@ class DirBlock:
         if path_selectors:
             if self.match_path(path_selectors):
                 return 0
-        if name_selectors:
+        if name_selector:
             # find all names to exclude
-            if self.match_contents(name_selectors):
+            if self.match_contents(name_selector):
                 # complement selection
                 rslts = [name for name in self.contents if name not in self.selection]
                 # apply limit to selected entries
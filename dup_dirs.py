@@ -31,14 +31,14 @@ class DirHashStack:
 
     >>> ds = DirHashStack()
     >>> contents1 = [(False, b'some'), (False, b'file'), (False, b'and'), (True, b'dir'), (False, b'from'), (False, b'contents')]
-    >>> contents2 = [(0, 'some'), (1, 'other'), (0, 'contents')]
+    >>> contents2 = [(0, b'some'), (1, b'other'), (0, b'contents')]
 
     >>> ds.select(b"/a/b/c")
     [b'', b'a', b'b', b'c']
     >>> DirHashStack.INITIAL_CK
     'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
     >>> DirHashStack.EMPTY_DIR_CK
-    '4f53cda18c2baa0c0354bb5f9a3ecbe5ed12ab4d8e11ba873c2f11161202b945'
+    '81db67b6a5702b9b68f0016f061c409bf3fb16d062fc854d1b424bb4e9c28c56'
     >>> ds.get_checksum(1) == DirHashStack.INITIAL_CK
     True
     >>> ds.get_checksums() == [DirHashStack.INITIAL_CK]*4
@@ -49,26 +49,29 @@ class DirHashStack:
     >>> ds.select(b"/a/b/e")
     [b'', b'a', b'b', b'e']
     >>> ck2 = ds.sum_contents(contents2).hexdigest(); ck2
-    'c3519456f6e17deefa2f84dbd38d95b26dc36a4c68b84728bf73cb2d949b279f'
+    'e24be099c6d87d168c1a53d303081fbe67b1a3a0be9aec1fd989f53474822c1e'
     >>> ck0=ds.get_checksum(0); ck3=ds.get_checksum(3); ck3 != ck0
     True
     >>> ds.entries() # doctest: +NORMALIZE_WHITESPACE
-    [(b'',  'dbd445cc0fc3f1ffa5a78a69f16402ace7c7ec95462e20d808cd3ded6c8992f2'),
-     (b'a', 'dbd445cc0fc3f1ffa5a78a69f16402ace7c7ec95462e20d808cd3ded6c8992f2'),
-     (b'b', 'dbd445cc0fc3f1ffa5a78a69f16402ace7c7ec95462e20d808cd3ded6c8992f2'),
-     (b'e', 'c3519456f6e17deefa2f84dbd38d95b26dc36a4c68b84728bf73cb2d949b279f')]
+    [(b'',  'a0473f34030343d71a5aff6ee73c61d4b29600f4bd6b194549a92308db5b159f'),
+     (b'a', 'a0473f34030343d71a5aff6ee73c61d4b29600f4bd6b194549a92308db5b159f'),
+     (b'b', 'a0473f34030343d71a5aff6ee73c61d4b29600f4bd6b194549a92308db5b159f'),
+     (b'e', 'e24be099c6d87d168c1a53d303081fbe67b1a3a0be9aec1fd989f53474822c1e')]
     >>> ds.get_checksums() == [ck0]*3 + [ck3]
     True
 
 
     """
+    # version of the contents encoding, changing it changes all checksums
+    CK_VERSION = b'v2\n'
     INITIAL_CK = hashlib.sha256().hexdigest()
-    EMPTY_DIR_CK = hashlib.sha256(b'[]').hexdigest()
+    EMPTY_DIR_CK = hashlib.sha256(CK_VERSION).hexdigest()
 
     def __init__(self,on_push=None, on_pop=None):
         self.stack = []
         self.on_push = on_push
         self.on_pop = on_pop
+        self._buf = bytearray()
 
     # -------------------------- Stack read access
     def level(self):
@@ -136,7 +139,8 @@ class DirHashStack:
         (b'b', 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')
 
         """
-        LOGGER.debug("pop(): %r - %r", self.stack[-1][0], self.stack[-1][1].hexdigest())
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("pop(): %r - %r", self.stack[-1][0], self.stack[-1][1].hexdigest())
         name, h = self.stack.pop()
         ck = h.hexdigest()
         if self.on_pop:
@@ -199,14 +203,44 @@ class DirHashStack:
         self.pushx(l1[lvl:])
         return self.dir_names()
 
-    def sum_contents(self, contents, encoding='utf_8'):
-        # Separate entries with "\0", dirs with "\n
-        # chunk = ("\0".join(contents) + "\n").encode(encoding)
-        chunk = repr(contents).encode(encoding)
-        LOGGER.debug("sum_contents(%r)", contents)
+    @staticmethod
+    def encode_contents(contents, buf=None):
+        r"""
+        Canonical binary representation of directory contents:
+        a type byte, `D` for a subdirectory or `F` for a file,
+        then the entry name, null terminated.
+        `CK_VERSION` comes first and separates directories.
+
+        >>> DirHashStack.encode_contents([(True, b'dir'), (False, b'file')])
+        bytearray(b'v2\nDdir\x00Ffile\x00')
+        >>> DirHashStack.encode_contents([]) == DirHashStack.CK_VERSION
+        True
+
+        :param contents: list of (flag, name) entries, names as bytes
+        :param buf: bytearray to reuse, its previous contents are discarded
+        :return: bytearray, `buf` if given
+        """
+        if buf is None:
+            buf = bytearray()
+        else:
+            buf.clear()
+        buf += DirHashStack.CK_VERSION
+        for flag, name in contents:
+            buf.append(68 if flag else 70)  # b'D' or b'F'
+            buf += name
+            buf.append(0)
+        return buf
+
+    def sum_contents(self, contents):
+        # reuse the same buffer for every directory
+        chunk = self.encode_contents(contents, self._buf)
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
+        if debug:
+            LOGGER.debug("sum_contents(%r)", contents)
         for a, h in self.stack:
             h.update(chunk)
-            LOGGER.debug("%r: %r", a, h.hexdigest())
+            if debug:
+                LOGGER.debug("%r: %r", a, h.hexdigest())
         return hashlib.sha256(chunk)
 
 class App:
@@ -219,9 +253,9 @@ class App:
     def __init__(self, args):
         self.args = args
         # convert and compile patterns
-        self.selectors= cli.regex_compile(args.dir_selectors,
-                             use_regexps=args.use_regexps,
-                             ignore_case=args.ignore_case)
+        self.selector = cli.regex_combine(args.dir_selectors,
+                                          use_regexps=args.use_regexps,
+                                          ignore_case=args.ignore_case)
 
         self.ds = DirHashStack(self.push_handler, self.pop_handler)
         self.tree = DictOfLists()
@@ -234,7 +268,7 @@ class App:
         >> from cli import main_parser
         >> args = main_parser().parse_args("-d /tmp/MyBook.db -I 100 dups .*[Pp]hotos?/?".split())
         >>> args = argparse.Namespace(database='data/virtualenvs.db', dir_selectors=['/home/mich/.virtualenvs/*'],
-        ...         limit_input_dirs=0, use_regexps=False, ignore_case=False)
+        ...         limit_input_dirs=0, use_regexps=False, ignore_case=False, cache_index=False)
         >>> app = App(args)
         >>> app.run() # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
         Reporting Duplicates
@@ -248,9 +282,15 @@ class App:
         """
         mdb = mlocate.MLocateDB()
         mdb.connect(self.args.database)
+        if self.args.cache_index:
+            mdb.load_index()
 
+        if self.selector is None:
+            # no directory selected
+            self.report()
+            return
         for d in mdb.load_dirs(self.args.limit_input_dirs):
-            if d.match_path(self.selectors):
+            if d.match_path(self.selector):
                 self.process_dir(d)
 
         self.report()
@@ -280,6 +320,9 @@ class App:
         :type ds: DirHashStack
         :type ck: str
         """
+        if ck == DirHashStack.EMPTY_DIR_CK:
+            # empty directories are never reported as duplicates
+            return
         self.tree.add_to(ds.get_checksum(-1), ck)
         dpath = os.sep.encode().join(ds.dir_names()+[name])
         self.by_ck.add_to(ck, dpath)
@@ -295,17 +338,18 @@ class App:
             for d in contents:
                 self.rtree.add_to(d, ck)
 
-        # Select duplicated checksums
-        dups = [ck for ck, l in self.by_ck.items() if (ck != DirHashStack.EMPTY_DIR_CK) and (len(l) > 1)]
+        # Select duplicated checksums, with their sorted directories
+        dups = [(ck, sorted(dirs)) for ck, dirs in self.by_ck.items() if len(dirs) > 1]
         if not dups:
             print("No duplicate found")
             return None
+        dup_cks = {ck for ck, dirs in dups}
 
         print ("Reporting Duplicates ")
-        for ck in dups:
+        for ck, dirs in dups:
             # Check if all parents are as well duplicates (subdup)
             parents = self.rtree[ck]
-            top = [p for p in parents if p not in dups]
+            top = [p for p in parents if p not in dup_cks]
             if not top:
                 LOGGER.info("Skipping subdup: %s", ck)
                 #typ = 'sub'
@@ -316,9 +360,8 @@ class App:
             else:
                 typ = 'top'
 
-            dirs = self.by_ck[ck]
             print("* {0} : {1} potential duplicates ({2})".format(ck, len(dirs), typ))
-            for d in sorted(dirs):
+            for d in dirs:
                 print("   -", safe_decode(d))
 
     def dups(self):
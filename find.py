@@ -9,17 +9,29 @@
 Filter directories which contain an entry matching some of the given patterns
 
 """
+import collections
+import concurrent.futures
 import fnmatch
+import itertools
 import logging
+import queue
 import re
 import json
+import sys
+import threading
 
 import binutils
 import mlocate
+from binutils import flush_out, write_out
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+
 def print_dir_test(d, r=True):
     """
     Prints a single line describing the given directory
@@ -33,7 +45,7 @@ def print_dir_test(d, r=True):
     :param r: Unused. Present to match action signature
     """
     assert r
-    print("{0} {1}".format(d.dt, binutils.safe_decode(d.name)))
+    write_out("%s %s\n" % (d.dt.isoformat(" "), binutils.safe_decode(d.name)))
 
 
 def print_dir_count(d, r):
@@ -48,7 +60,7 @@ def print_dir_count(d, r):
     :param d: dict representing a directory
     :param r: the matches count
     """
-    print("[{0}] {2} matches in {1}".format(d.dt, binutils.safe_decode(d.name), len(r)))
+    write_out("[%s] %d matches in %s\n" % (d.dt.isoformat(" "), len(r), binutils.safe_decode(d.name)))
 
 
 def print_dir_list(d, r):
@@ -64,9 +76,50 @@ def print_dir_list(d, r):
     :param d: dict representing a directory
     :param r: list of matched entries
     """
-    print("* {0} {1}".format(d.dt, binutils.safe_decode(d.name)))
-    for f in r:
-        print("    - {0}{1}".format(binutils.safe_decode(f[1]), ["", "/"][f[0]]))
+    # a single write for the whole section, directories may hold thousands of matches
+    lines = ["* %s %s" % (d.dt.isoformat(" "), binutils.safe_decode(d.name))]
+    names = binutils.safe_decode_all([f[1] for f in r])
+    lines.extend("    - %s%s" % (n, "/" if f[0] else "") for f, n in zip(r, names))
+    lines.append("")
+    write_out("\n".join(lines))
+
+
+# shared by all directories, rather than set up by each json.dumps() call
+_json_encoder = json.JSONEncoder(indent=2)
+
+
+def encode_dir_json(d, r):
+    r"""
+    JSON section showing matches for a single directory, as bytes.
+    Uses orjson when available and it writes the same bytes
+    as the json module, that is when all characters are ASCII, DEL aside.
+
+    >>> from datetime import datetime
+    >>> dt = datetime(2017, 7, 20, 13, 22, 43, 817771)
+    >>> encode_dir_json(mlocate.DirBlock(b'/d', dt, []), [])
+    b'{\n  "dt": "2017-07-20 13:22:43.817771",\n  "matches": [],\n  "name": "/d"\n}'
+
+    Non-ASCII characters are escaped:
+
+    >>> encode_dir_json(mlocate.DirBlock(b'/d', dt, []), [(False, b'\xc3\xa9t\xc3\xa9.ini')])
+    b'{\n  "dt": "2017-07-20 13:22:43.817771",\n  "matches": [\n    [\n      false,\n      "\\u00e9t\\u00e9.ini"\n    ]\n  ],\n  "name": "/d"\n}'
+
+    :param d: DirBlock representing a directory
+    :param r: list of matched entries
+    :return: bytes
+    """
+    # keys in sorted order already, the encoder keeps it
+    data = dict(dt=d.dt.isoformat(" "),
+                matches=list(zip([f[0] for f in r],
+                                 binutils.safe_decode_all([f[1] for f in r]))),
+                name=binutils.safe_decode(d.name))
+    if orjson is not None:
+        encoded = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        # same bytes, unless characters must be escaped as \uXXXX
+        # like json does beyond printable ASCII: orjson can't
+        if encoded.isascii() and b'\x7f' not in encoded:
+            return encoded
+    return _json_encoder.encode(data).encode()
 
 
 def print_dir_json(d, r):
@@ -89,8 +142,58 @@ def print_dir_json(d, r):
     :param d: DirBlock representing a directory
     :param r: list of matched entries
     """
-    data = dict(name=binutils.safe_decode(d.name), dt=str(d.dt), matches=[(flag, binutils.safe_decode(f)) for flag, f in r])
-    print(json.dumps(data, indent=2, sort_keys=True))
+    write_out(encode_dir_json(d, r) + b"\n")
+
+
+class JsonArrayWriter:
+    """
+    Writes directory sections as the items of a single JSON array.
+
+    >>> from datetime import datetime
+    >>> dt = datetime(2017, 7, 20, 13, 22, 43, 817771)
+    >>> w = JsonArrayWriter()
+    >>> w.write_open()
+    [
+    >>> w.write_close()
+    ]
+    >>> w.write_item(mlocate.DirBlock(b'/d', dt, []), [(False, b'f')])
+    ... # doctest: +NORMALIZE_WHITESPACE
+    {
+      "dt": "2017-07-20 13:22:43.817771",
+      "matches": [ [ false, "f" ] ],
+      "name": "/d"
+    }
+    >>> w.write_item(mlocate.DirBlock(b'/e', dt, []), [])
+    ... # doctest: +ELLIPSIS
+    ,
+    {
+      "dt": ...
+    }
+
+    :param out: binary stream, defaults to the standard output, see `binutils.write_out()`
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self.count = 0
+
+    def _write(self, data):
+        if self.out is None:
+            write_out(data)
+        else:
+            self.out.write(data)
+
+    def write_open(self):
+        self._write(b"[\n")
+
+    def write_item(self, d, r):
+        if self.count:
+            self._write(b",\n")
+        self._write(encode_dir_json(d, r) + b"\n")
+        self.count += 1
+
+    def write_close(self):
+        self._write(b"]\n")
 
 
 actions = {
@@ -100,6 +203,192 @@ actions = {
     'json': print_dir_json
 }
 
+# count of directories sent at once to a worker process
+CHUNK_SIZE = 256
+
+# database, selectors and matching options of the current worker process
+_worker = {}
+
+# count of chunks of directories read ahead by `prefetch()`
+PREFETCH_CHUNKS = 4
+
+# end of prefetched items
+_END = object()
+
+
+def prefetch(iterable, chunk_size=CHUNK_SIZE, chunks=PREFETCH_CHUNKS):
+    """
+    Iterates over `iterable` in a background thread, reading up to
+    `chunks` chunks of items ahead, so that reading the database
+    overlaps with matching and printing.
+    Items are queued by chunks, a queue operation per item would cost
+    more than it saves.
+
+    >>> list(prefetch(range(10), chunk_size=3, chunks=1))
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    >>> list(prefetch(1 // x for x in (1, 0)))
+    Traceback (most recent call last):
+    ...
+    ZeroDivisionError: integer division or modulo by zero
+
+    :param iterable: typically `MLocateDB.load_dirs()`
+    :param chunk_size: count of items queued at once
+    :param chunks: maximum count of chunks waiting in queue
+    :return: generator of the same items, in the same order
+    """
+    q = queue.Queue(chunks)
+    stopped = threading.Event()
+    error = []
+
+    def put(item):
+        # give up when the consumer is gone
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(iterable)
+        try:
+            for chunk in iter(lambda: list(itertools.islice(it, chunk_size)), []):
+                if not put(chunk):
+                    return
+        except Exception as e:
+            # raised in the consumer's thread
+            error.append(e)
+        put(_END)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        for chunk in iter(q.get, _END):
+            yield from chunk
+        if error:
+            raise error[0]
+    finally:
+        stopped.set()
+
+
+def _match_test(dirs, selector, limit):
+    # a boolean is enough: stop at the first matching entry
+    for d in dirs:
+        if d.match_any(selector):
+            yield d, True
+
+
+def _match_list(dirs, selector, limit):
+    for d in dirs:
+        r = d.match_contents(selector, limit)
+        if r:
+            yield d, r
+
+
+# matching loop for each action, chosen once rather than for each directory
+matchers = {
+    'test': _match_test,
+    'count': _match_list,
+    'list': _match_list,
+    'json': _match_list
+}
+
+
+def match_dirs(dirs, selector, action='list', limit=0, prefilter=None):
+    r"""
+    Generator of directories having entries matching the selector.
+    With a `prefilter`, directories where it finds nothing are skipped
+    before matching their entries one by one.
+
+    >>> import re
+    >>> dirs = [mlocate.DirBlock(b'/a', None, [(False, b'a.ini'), (False, b'b.ini')]),
+    ...         mlocate.DirBlock(b'/b', None, [(False, b'b.txt')])]
+    >>> [(d.name, r) for d, r in match_dirs(dirs, re.compile(rb'.*\.ini'), limit=1)]
+    [(b'/a', [(False, b'a.ini')])]
+    >>> [(d.name, r) for d, r in match_dirs(dirs, re.compile(rb'.*\.txt'), 'test')]
+    [(b'/b', True)]
+
+    :param dirs: iterable of DirBlock
+    :param selector: compiled regexp searched in dir contents
+    :param action: one of `actions`, 'test' only checks that some entry
+                   matches, without collecting them
+    :param limit: maximum count of matched entries per directory
+    :param prefilter: compiled regexp for `DirBlock.search_names()`, or None
+    :return: (DirBlock, matches) pairs, matches being the list of matched
+             entries, or True for 'test'
+    """
+    if prefilter is not None:
+        dirs = (d for d in dirs if d.search_names(prefilter))
+    return matchers[action](dirs, selector, limit)
+
+
+def _init_worker(database, cache_index, patterns, use_regexps, ignore_case, action, limit):
+    # each worker maps the database itself, sharing the page cache
+    mdb = mlocate.MLocateDB()
+    mdb.connect(database)
+    if cache_index:
+        # built by the main process already
+        mdb.load_index()
+    _worker['mdb'] = mdb
+    # compiled regexps can't be pickled, each worker compiles its own
+    from cli import regex_combine, regex_prefilter
+    _worker['selector'] = regex_combine(patterns,
+                                        use_regexps=use_regexps,
+                                        ignore_case=ignore_case)
+    _worker['prefilter'] = regex_prefilter(patterns,
+                                           use_regexps=use_regexps,
+                                           ignore_case=ignore_case)
+    _worker['action'] = action
+    _worker['limit'] = limit
+
+
+def _match_range(off, count):
+    # loads and matches `count` directories from offset `off`
+    mdb = _worker['mdb']
+    mdb.seek(off)
+    matches = match_dirs(mdb.load_dirs(count), _worker['selector'], _worker['action'],
+                         _worker['limit'], _worker['prefilter'])
+    # only names and times are printed with matches: don't pickle
+    # whole directory contents back to the main process
+    return [(mlocate.DirBlock(d.name, sec=d.sec, nsec=d.nsec), r) for d, r in matches]
+
+
+def match_dirs_parallel(mdb, args):
+    """
+    Same as `match_dirs()` over the directories of `mdb`, spreading
+    ranges of directories over `args.jobs` worker processes.
+    The main process only finds where directories start, see
+    `MLocateDB.dir_offsets()`: workers parse the ranges from their
+    own mapping of the database, only offsets are sent to them.
+    Results are yielded in the order of directories in the database.
+
+    :param mdb: mlocate.MLocateDB, connected
+    :param args: argparse.Namespace
+    :return: (DirBlock, matches) pairs
+    """
+    init_args = (args.database, args.cache_index, args.patterns, args.use_regexps, args.ignore_case,
+                 args.action, args.limit_output_match)
+    offsets = mdb.dir_offsets()
+    if args.limit_input_dirs:
+        offsets = itertools.islice(offsets, args.limit_input_dirs)
+    chunks = iter(lambda: list(itertools.islice(offsets, CHUNK_SIZE)), [])
+    # Executor.map() would submit all chunks at once, reading the whole
+    # database ahead: keep a bounded window of futures, oldest first
+    window = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(args.jobs, initializer=_init_worker,
+                                                initargs=init_args) as pool:
+        try:
+            for chunk in chunks:
+                window.append(pool.submit(_match_range, chunk[0], len(chunk)))
+                if len(window) >= 2 * args.jobs:
+                    yield from window.popleft().result()
+            while window:
+                yield from window.popleft().result()
+        finally:
+            # output stopped early: drop chunks not started yet
+            for f in window:
+                f.cancel()
+
 
 def do_filter(mdb, args):
     """
@@ -111,7 +400,7 @@ def do_filter(mdb, args):
     ...                           use_regexps=False, ignore_case=False,
     ...                           limit_input_dirs=10,
     ...                           limit_output_dirs=0,
-    ...                           limit_output_match=0)
+    ...                           limit_output_match=0, jobs=1, prefetch=False)
     >>> do_filter(mdb,args)
     * 2013-08-16 17:03:59.956254 /run/media/mich/MyBook/$RECYCLE.BIN/S-1-5-21-1696441804-2191777423-1598828944-1001
         - desktop.ini
@@ -120,7 +409,7 @@ def do_filter(mdb, args):
     ...                           use_regexps=False, ignore_case=False,
     ...                           limit_input_dirs=100,
     ...                           limit_output_dirs=3,
-    ...                           limit_output_match=5)
+    ...                           limit_output_match=5, jobs=1, prefetch=False)
     >>> do_filter(mdb,args) # doctest: +ELLIPSIS +NORMALIZE_WHITESPACE
     [
     {
@@ -168,29 +457,47 @@ def do_filter(mdb, args):
         print("You should explicitly provide entries patterns, '*' for all.")
         return
 
-    # convert and compile patterns
-    from cli import regex_compile
-    selectors= regex_compile(args.patterns,
-                             use_regexps=args.use_regexps,
-                             ignore_case=args.ignore_case)
-
     count = 0
+    if args.jobs > 1:
+        if args.prefetch:
+            # each worker reads its own range of the database
+            logger.warning("--prefetch is ignored with several jobs")
+        matches = match_dirs_parallel(mdb, args)
+    else:
+        dirs = mdb.load_dirs(args.limit_input_dirs)
+        if args.prefetch:
+            dirs = prefetch(dirs)
+        # convert and compile patterns
+        from cli import regex_combine, regex_prefilter
+        selector = regex_combine(args.patterns,
+                                 use_regexps=args.use_regexps,
+                                 ignore_case=args.ignore_case)
+        prefilter = regex_prefilter(args.patterns,
+                                    use_regexps=args.use_regexps,
+                                    ignore_case=args.ignore_case)
+        matches = match_dirs(dirs, selector, args.action,
+                             args.limit_output_match, prefilter)
 
-    if args.action == 'test':
-        limit = 1
+    # anything printed as text so far comes first
+    sys.stdout.flush()
+    writer = None
+    if args.action == 'json':
+        writer = JsonArrayWriter()
+        writer.write_open()
+        action_fn = writer.write_item
     else:
-        limit = args.limit_output_match
-    if args.action == 'json': print("[")
+        action_fn = actions[args.action]
+    limit_dirs = args.limit_output_dirs
 
-    for d in mdb.load_dirs(args.limit_input_dirs):
-        r = d.match_contents(selectors, limit)
-        if r:
-            #d1 = d.decode()
-            if count and args.action == 'json': print(",")
-            # noinspection PyCallingNonCallable
-            actions[args.action](d, r)
-            count += 1
-            if args.limit_output_dirs and (count >= args.limit_output_dirs):
-                break
-    if args.action == 'json': print("]")
+    for d, r in matches:
+        action_fn(d, r)
+        count += 1
+        if limit_dirs and (count >= limit_dirs):
+            # stop reading the database right away: worker processes and
+            # the prefetch thread are released now, not when collected
+            matches.close()
+            break
+    if writer:
+        writer.write_close()
+    flush_out()
 
@@ -5,17 +5,37 @@
 Parse and use mlocate databases.
 """
 
+import array
+import bisect
+import glob
+import hashlib
 import logging
+import mmap
+import os
+import re
 import struct
-import datetime
 import json
 
-import binutils
+from binutils import read_cstring
 from dirblock import DirBlock
 
 
 logger = logging.getLogger(__name__)
 
+# directory header: seconds, nanoseconds, then 4 padding bytes left unread
+_DIR_HEADER = struct.Struct('>ql')
+_DIR_HEADER_SIZE = _DIR_HEADER.size + 4
+
+# entries list of a directory, up to its end byte
+_ENTRIES = re.compile(rb'(?:[\x00\x01][^\x00]*\x00)*\x02')
+
+# where directory indexes are kept, see `MLocateDB.load_index()`
+INDEX_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mlocate-tools')
+
+# size of the ranges the kernel is asked to load ahead of the cursor,
+# a multiple of the page size
+READAHEAD_SIZE = 2 << 20
+
 
 class MLocateDB:
     """
@@ -27,8 +47,6 @@ class MLocateDB:
     [('conf_block_size', 544), ('file_format', 0), ('req_visibility', 0), ('root', b'/run/media/mich/MyBook')]
     >>> mdb.tell()
     583
-    >>> mdb.db.seek(583)
-    583
     >>> #[mdb.load_dirs() for i in range(3)]
     >>> for i, d in enumerate(mdb.load_dirs()): # doctest: +ELLIPSIS,+NORMALIZE_WHITESPACE
     ...     print (i, json.dumps(d._decode(),indent=2,sort_keys=True))
@@ -53,7 +71,10 @@ class MLocateDB:
     """
 
     def __init__(self):
-        self.db = None
+        self.mm = None
+        self.path = None
+        self.off = 0
+        self.index = None
         self.header = None
         self.conf = None
         self.dirs = None
@@ -61,11 +82,29 @@ class MLocateDB:
 
     def connect(self, path):
         """
-        Opens the database file, reads the header and configuration.
+        Maps the database file in memory, reads the header and configuration.
+
+        The file is not read through a file object: data is sliced
+        out of the mapping at the `off` cursor, straight from the page cache,
+        and null terminated names are found with `mmap.find()`,
+        a C `memchr()` scan instead of byte per byte reads.
 
         :param path: path to the mlocate database
         """
-        self.db = open(path, 'rb')
+        self.path = path
+        self.index = None
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                # databases are scanned from start to end: read ahead aggressively
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            self.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            # the mapping stays valid once the file is closed
+            os.close(fd)
+        self.off = 0
+        if hasattr(self.mm, 'madvise'):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
         self._read_header()
         self._read_conf()
 
@@ -76,19 +115,137 @@ class MLocateDB:
 
         :return: current position in the file.
         """
-        self.pos = self.db.tell()
+        self.pos = self.off
         return self.pos
 
+    def seek(self, off):
+        """
+        Moves the cursor, typically to a directory offset
+        from `dir_offsets()`.
+
+        :param off: position in the file
+        """
+        self.off = off
+
+    def dir_offsets(self):
+        r"""
+        Generator of the offsets of directories, from the cursor on,
+        without moving it: only the end of each directory is searched,
+        no entry nor DirBlock is built. Ranges of directories can then
+        be loaded separately, e.g. by worker processes, see `seek()`.
+
+        >>> mdb = MLocateDB()
+        >>> mdb.mm = b'\x00' * 16 + b'/a\x00\x00f\x00\x02' + b'\x00' * 16 + b'/b\x00\x02'
+        >>> list(mdb.dir_offsets())
+        [0, 23]
+
+        :return: int offsets
+        """
+        if self.index is not None:
+            # all but the end of the last directory, read in place
+            index = self.index
+            for i in range(bisect.bisect_left(index, self.off), len(index) - 1):
+                yield index[i]
+            return
+        mm = self.mm
+        off = self.off
+        size = len(mm)
+        while off + _DIR_HEADER_SIZE <= size:
+            yield off
+            off = mm.find(b'\0', off + _DIR_HEADER_SIZE) + 1
+            off = _ENTRIES.match(mm, off).end()
+
+    def load_index(self, cache_dir=INDEX_CACHE_DIR):
+        r"""
+        Loads the offsets of all directories, found once by `dir_offsets()`
+        then cached as a file in `cache_dir`, named after the database path,
+        size and modification time: an updated database gets a new index,
+        and its previous ones are removed.
+        Directories entries are then sliced up to the next offset,
+        instead of searching their end.
+        Must be called right after `connect()`.
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as tmp:
+        ...     path = os.path.join(tmp, 'test.db')
+        ...     with open(path, 'wb') as f:
+        ...         _ = f.write(b'\x00mlocate' + struct.pack('>ibbh', 0, 0, 0, 0) + b'/\x00'
+        ...                     + b'\x00' * 16 + b'/a\x00\x00f\x00\x02' + b'\x00' * 16 + b'/b\x00\x02')
+        ...     mdb = MLocateDB()
+        ...     mdb.connect(path)
+        ...     mdb.load_index(tmp)
+        ...     built = list(mdb.index)
+        ...     mdb.connect(path)
+        ...     mdb.load_index(tmp)
+        ...     reloaded = list(mdb.index)
+        ...     os.utime(path, ns=(0, 0))  # as updated: a new index replaces the old one
+        ...     mdb.connect(path)
+        ...     mdb.load_index(tmp)
+        ...     mdb.mm = None  # release the mapping before cleanup
+        ...     len(os.listdir(tmp)), built, reloaded, list(mdb.index)
+        (2, [18, 41, 61], [18, 41, 61], [18, 41, 61])
+
+        :param cache_dir: directory of index files, created if needed
+        """
+        st = os.stat(self.path)
+        key = hashlib.sha1(os.fsencode(os.path.abspath(self.path))).hexdigest()
+        index_path = os.path.join(cache_dir, "%s-%d-%d.idx" % (key, st.st_size, st.st_mtime_ns))
+        index_glob = os.path.join(glob.escape(cache_dir), "%s-*.idx" % key)
+        index = array.array('Q')
+        try:
+            with open(index_path, 'rb') as f:
+                index.frombytes(f.read())
+            self.index = index
+            return
+        except OSError:
+            pass
+        index.extend(self.dir_offsets())
+        if index:
+            # end of the last directory, so that it is sliced like the others
+            off = self.mm.find(b'\0', index[-1] + _DIR_HEADER_SIZE) + 1
+            index.append(_ENTRIES.match(self.mm, off).end())
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # written aside then renamed: concurrent runs never read it partly written
+            tmp_path = "%s.%d" % (index_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                index.tofile(f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning("Can't cache directory index in %s: %s", cache_dir, e)
+        else:
+            # indexes of previous versions of the database
+            for stale_path in glob.glob(index_glob):
+                if stale_path != index_path:
+                    try:
+                        os.remove(stale_path)
+                    except OSError as e:
+                        logger.warning("Can't remove stale index %s: %s", stale_path, e)
+        self.index = index
+
+    def _read(self, size):
+        # next `size` bytes at the cursor
+        off = self.off
+        self.off = off + size
+        return self.mm[off:off + size]
+
+    def _read_cstring(self):
+        # null terminated bytes string at the cursor, without the null byte
+        self.mm.seek(self.off)
+        data = read_cstring(self.mm)
+        self.off = self.mm.tell()
+        return data
+
     def _read_header(self):
         logger.info('reading header')
-        magic = self.db.read(8)
+        magic = self._read(8)
         assert (magic == b"\0mlocate")
 
         # int.from_bytes(buf,'big')
-        data = struct.unpack('>ibbh', self.db.read(8))
+        data = struct.unpack('>ibbh', self._read(8))
         flds = 'conf_block_size, file_format, req_visibility'.split(', ')
         self.header = dict(zip(flds, data[:-1]))  # padding ignored
-        self.header['root'] = binutils.read_cstring(self.db)
+        self.header['root'] = self._read_cstring()
         self.tell()
 
     def _read_conf(self):
@@ -96,7 +253,7 @@ class MLocateDB:
         if not self.header:
             self._read_header()
 
-        conf_block = self.db.read(self.header['conf_block_size'])
+        conf_block = self._read(self.header['conf_block_size'])
         self.conf = {}
         grp = []
         for s in conf_block.split(b'\x00'):
@@ -161,9 +318,23 @@ class MLocateDB:
 
 
     def load_some_dirs(self, dir_test, **kwargs):
-        """
+        r"""
         Generator for directory elements.
 
+        The parsing loop is inlined, working on local copies of the
+        mapping and cursor, `self.off` is only updated once per directory.
+        Entries are walked by the regexp engine in C instead of a Python
+        loop per entry: each entry is a flag byte, 0 for a file or 1 for
+        a subdirectory, then a null terminated name, and the list ends with
+        a flag byte 2. File flags are null bytes themselves, and names may
+        contain any other byte: entries can only be told apart from the start.
+
+        >>> mdb = MLocateDB()
+        >>> mdb.mm = (b'\x00' * 16 + b'/dir\x00\x00file\x00\x01sub\x00\x00\x02odd\x00\x02'
+        ...           + b'\x00' * 16 + b'/empty\x00\x02')
+        >>> [(d.name, d.names, bytes(d.kinds)) for d in mdb.load_dirs()]
+        [(b'/dir', [b'file', b'sub', b'\x02odd'], b'\x00\x01\x00'), (b'/empty', [], b'')]
+
         :param dir_test: a function(num, dir_block, ...) -> int
                should return 0 to skip, -1 to stop iteration, 1 to yield and continue
         :param kwargs: keyword arguments to pass to dir_test()
@@ -176,20 +347,51 @@ class MLocateDB:
 
         """
         dir_idx = 0
+        mm = self.mm
+        off = self.off
+        size = len(mm)
+        unpack_header = _DIR_HEADER.unpack_from
+        header_size = _DIR_HEADER_SIZE
+        match_entries = _ENTRIES.match
+        # ends of directories are the next ones starts, no need to search them:
+        # position in the index of the end of the next directory
+        index = self.index
+        i = indexed = 0
+        if index is not None:
+            i = bisect.bisect_right(index, off)
+            indexed = len(index)
+        willneed = hasattr(mm, 'madvise')
+        # end of the range already requested from the kernel
+        ahead = off - off % READAHEAD_SIZE
 
         while True:
+            if willneed and ahead < size and off >= ahead - READAHEAD_SIZE:
+                # keep the next range on its way while this one is parsed
+                mm.madvise(mmap.MADV_WILLNEED, ahead, min(READAHEAD_SIZE, size - ahead))
+                ahead += READAHEAD_SIZE
             # header
-            buf = self.db.read(16)
-            if len(buf) < 16:
-                logger.info("End of file reached. %s tail bytes", len(buf))
+            if off + header_size > size:
+                logger.info("End of file reached. %s tail bytes", size - off)
                 break
                 # raise StopIteration
 
             # directory details
-            dir_seconds, dir_nanos, padding = struct.unpack('>qli', buf)
-            d = DirBlock(name=binutils.read_cstring(self.db),
-                         dt=datetime.datetime.fromtimestamp(dir_seconds).replace(microsecond=round(dir_nanos / 1000)),
-                         contents= [t for t in iter(self._read_direntry, None)]
+            dir_seconds, dir_nanos = unpack_header(mm, off)
+            off += header_size
+            end = mm.find(b'\0', off)
+            name = mm[off:end]
+            off = end + 1
+            # entries, up to the end byte, split by DirBlock when needed
+            if i < indexed:
+                end = index[i]
+                i += 1
+            else:
+                end = match_entries(mm, off).end()
+            entries = mm[off:end - 1]
+            self.off = off = end
+            d = DirBlock(name=name,
+                         sec=dir_seconds, nsec=dir_nanos,
+                         entries=entries
             )
             # NOTE generator not wanted for dir entries: data must be read now always.
             dir_idx += 1
@@ -198,15 +400,3 @@ class MLocateDB:
                 break
             if test > 0:
                 yield d
-
-
-    def _read_direntry(self):
-        flag = struct.unpack('b', self.db.read(1))[0]
-        if flag == 2:
-            # print('end of dir')
-            return None  # end of directory contents
-        name = binutils.read_cstring(self.db)
-        # print (flag, name)
-        return bool(flag), name
-
-
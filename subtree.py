@@ -63,11 +63,8 @@ Parses an mlocate database and prints parts of its contents.
 
 
 """
-import fnmatch
 import logging
 import argparse
-import re
-import sys
 import mlocate
 from tree import Tree
 
@@ -80,11 +77,23 @@ def print_tree(tree, depth=0):
 
 
 def do_subtree(mdb, args):
-    # convert and compile patterns
-    from cli import regex_compile
-    selectors= regex_compile(args.patterns,
+    # convert and compile patterns, into a single selector
+    from cli import regex_combine, LiteralSelector
+    selector = regex_combine(args.patterns,
                              use_regexps=args.use_regexps,
                              ignore_case=args.ignore_case)
+    limit = args.limit_output_dirs
+    if (isinstance(selector, LiteralSelector) and selector.fallback is None
+            and not (selector.prefixes or selector.suffixes or selector.substrings)):
+        # plain paths only, each selects a single directory:
+        # the rest of the database is skipped once they are all printed
+        if not limit or len(selector.names) < limit:
+            limit = len(selector.names)
+    if selector is None:
+        # no tree selected
+        return
+    # bound once, called directly on each directory path
+    search = selector.search
     tree = None
     count = 0
     for d in mdb.load_dirs(args.limit_input_dirs):
@@ -96,11 +105,10 @@ def do_subtree(mdb, args):
                 print_tree(tree, args.levels)
                 tree = None
                 count += 1
-                if args.limit_output_dirs and (count >= args.limit_output_dirs):
+                if limit and (count >= limit):
                     break
-        else:
-            if d.match_path(selectors):
-                tree = Tree(d.name + b"/")
+        elif search(d.name):
+            tree = Tree(d.name)
     if tree:
         print_tree(tree, args.levels)
 
@@ -1,25 +1,35 @@
 # coding=utf-8
 import logging
-from binutils import safe_decode
+from binutils import safe_decode, write_chunks
 
-logging.basicConfig(level=10)
+# graph glyphs, UTF-8 encoded
+_BRANCH = '├── '.encode()
+_LAST = '└── '.encode()
+_VBAR = '│\u00a0\u00a0 '.encode()
+_SPACE = b'    '
 
 class Tree:
     """
-    >>> o = Tree(b"/run/media/MyBook/"); o.rel_path
+    >>> o = Tree(b"/run/media/MyBook"); o.rel_path
     b''
-    >>> o.load(b"/run/media/MyBook/Archives")
+    >>> o.load(b"/run/media/MyBook/Archives"); o.rel_path
+    True
     b'Archives/'
-    >>> o.load(b"/run/media/MyBook/Archives/2012")
+    >>> o.load(b"/run/media/MyBook/Archives/2012"); o.rel_path
+    True
     b'Archives/2012/'
-    >>> o.load(b"/run/media/MyBook/Archives/2017/02")
+    >>> o.load(b"/run/media/MyBook/Archives/2017/02"); o.rel_path
+    True
     b'Archives/2017/02/'
     >>> o.depth
     3
-    >>> o.load(b"/run/media/MyBook/Backup/2017-02")
+    >>> o.load(b"/run/media/MyBook/Backup/2017-02"); o.rel_path
+    True
     b'Backup/2017-02/'
     >>> o.load(b"/run/media/Elsewhere") is None
     True
+    >>> o.load(b"/run/media/MyBookcase") is None
+    True
     >>> o.tree
     [[b'Archives', [[b'2012', []], [b'2017', [[b'02', []]]]]], [b'Backup', [[b'2017-02', []]]]]
     >>> o.as_string()
@@ -37,57 +47,111 @@ class Tree:
     └── Backup
         └── 2017-02
     """
-    def __init__(self, root=""):
+    def __init__(self, root=b""):
         logging.info("Creating tree from %r", root)
-        self.root = root
-        self.rel_path = b""
+        # kept without trailing slash, the path of the root directory itself
+        self.root = root.rstrip(b'/')
+        self._root_len = len(self.root)
+        # path of the last loaded directory
+        self._last_full = self.root
         self.stack = []
-        self.tree = []
-        #self.tip = self.tree
+        # nodes stored in parallel lists, indexed by order of creation,
+        # node 0 standing for the root; -1 marks a missing child or sibling
+        self.names = [self.root]
+        self.first_child = [-1]
+        self.next_sibling = [-1]
+        self.last_child = [-1]
+        # index of each node in stack, the root first
+        self.tips = [0]
 
     @property
     def depth(self):
         return len(self.stack)
 
-    def load(self, node_path):
+    @property
+    def tree(self):
+        """
+        Nested lists of `[name, children]` pairs, built on demand.
+        """
+        def _children(i):
+            children = []
+            c = self.first_child[i]
+            while c >= 0:
+                children.append([self.names[c], _children(c)])
+                c = self.next_sibling[c]
+            return children
+
+        return _children(0)
+
+    @property
+    def rel_path(self):
+        """
+        Path of the last loaded directory, relative to the root,
+        with a trailing slash. Built on demand, `load()` doesn't need it.
+        """
+        if not self.stack:
+            return b""
+        return b'/'.join(self.stack) + b'/'
 
-        if not node_path.startswith(self.root):
+    def load(self, node_path):
+        """
+        Adds a directory to the tree.
+
+        :param node_path: bytes, absolute path of the directory
+        :return: True, None if the directory is out of the tree
+        """
+        # mlocate lists subdirectories right after their parent:
+        # most paths extend the previous one, nothing to compare
+        last = self._last_full
+        n = len(last)
+        if node_path.startswith(last) and len(node_path) > n and node_path[n] == 0x2f:  # b'/'
+            self.pushx(self.split(node_path[n + 1:]))
+            self._last_full = node_path
+            return True
+
+        p1 = self._root_len
+        if not (node_path.startswith(self.root)
+                and len(node_path) > p1 and node_path[p1] == 0x2f):
             return None
 
-        p1 = len(self.root)
-        current = node_path[p1:]
-        nodes = self.split(current)
+        nodes = self.split(node_path[p1 + 1:])
 
+        # the split itself is cheaper than a segment by segment scan,
+        # only the comparison loop is kept short
         p2 = 0
-        for p in range(min(len(nodes), len(self.stack))):
-            if nodes[p] != self.stack[p]:
+        for node, stacked in zip(nodes, self.stack):
+            if node != stacked:
                 break
-            p2 = p+1
+            p2 += 1
 
         while (p2 < self.depth):
             self.pop()
 
         self.pushx(nodes[p2:])
-        self.rel_path = current + b'/'
-        return self.rel_path
+        self._last_full = node_path
+        return True
 
     def push(self, node):
-        logging.info("push(%r)", node)
-
-        tip = self.tree
-        for i in range(self.depth): tip = tip[-1][1]
-        # can't easily go back when popping, so compute each time
-        tip.append([node, []])
-
+        i = len(self.names)
+        self.names.append(node)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.last_child.append(-1)
+        parent = self.tips[-1]
+        previous = self.last_child[parent]
+        if previous < 0:
+            self.first_child[parent] = i
+        else:
+            self.next_sibling[previous] = i
+        self.last_child[parent] = i
+        self.tips.append(i)
         self.stack.append(node)
 
     def pop(self):
-        node = self.stack.pop()
-        logging.info("pop() => %r", node)
-        return node
+        self.tips.pop()
+        return self.stack.pop()
 
     def pushx(self, nodes):
-        logging.info("pushx(%r) onto %r", nodes, self.stack)
         if not nodes:
             return
         if len(nodes) != 1:
@@ -110,21 +174,39 @@ class Tree:
         _level(0, self.tree)
 
     def print_graph(self, max_depth=0):
-        def _level(prefix, depth,  st):
-            if st == []: return
-            if max_depth and depth >= max_depth:
+        # iterative walk, the encoded lines are written at once
+        lines = []
+        names = self.names
+        # names are written as read, unless one of them is not valid UTF-8
+        try:
+            b'\0'.join(names).decode()
+            escape = False
+        except UnicodeDecodeError:
+            escape = True
+        first_child = self.first_child
+        next_sibling = self.next_sibling
+        # shared prefix, extended on descent and truncated on ascent
+        prefix = bytearray()
+        # next node to print, its depth and prefix length
+        stack = [(first_child[0], 0, 0)]
+        while stack:
+            i, depth, size = stack.pop()
+            if i < 0:
+                continue
+            del prefix[size:]
+            last = next_sibling[i] < 0
+            name = safe_decode(names[i]).encode() if escape else names[i]
+            lines.append(prefix + (_LAST if last else _BRANCH) + name + b'\n')
+            stack.append((next_sibling[i], depth, size))
+            child = first_child[i]
+            if child < 0:
+                continue
+            if max_depth and depth + 1 >= max_depth:
                 logging.info("Maximum depth reached, omitting details")
-                return
-
-            #pfx = prefix + '├── '
-            for subtree in st[:-1]:
-                print(prefix + '├── '  + safe_decode(subtree[0]))
-                _level(prefix + "│   ", depth + 1, subtree[1])
-
-            print(prefix + '└── ' + safe_decode(st[-1][0]))
-            _level(prefix + '    ' , depth + 1, st[-1][1])
-
-        _level('', 0, self.tree)
+                continue
+            prefix += _SPACE if last else _VBAR
+            stack.append((child, depth + 1, len(prefix)))
+        write_chunks(lines)
 
     def as_graph0(self):
         indents = ('├── ', '└── ')